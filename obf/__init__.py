@@ -1,18 +1,78 @@
-try:
-    from Crypto.Hash import keccak
+from typing import Callable as _Callable, Tuple as _Tuple
+
+# Import order matters: remerkleable.tree imports merkle_hash and zero_hashes from the settings by name,
+# so the settings have to be overridden below, before anything imports remerkleable.tree.
+import remerkleable.settings as remerkleable_settings
+
+
+# Each loader returns a (keccak_256, merkle_hash) pair, or raises ImportError if the backend is not installed.
+
+def _load_pycryptodome(package: str):
+    keccak = __import__(package + '.Hash.keccak', fromlist=['new'])
 
     def keccak_256(x): return keccak.new(digest_bits=256, data=x).digest()
-except ImportError:
-    import sha3 as _sha3
 
-    def keccak_256(x): return _sha3.keccak_256(x).digest()
+    def merkle_hash(left: bytes, right: bytes) -> bytes:
+        return keccak_256(left + right)
 
-import remerkleable.settings as remerkleable_settings
+    return keccak_256, merkle_hash
+
+
+def _load_pysha3():
+    import sha3
+
+    def keccak_256(x): return sha3.keccak_256(x).digest()
+
+    # pysha3 hashers can be copied, so clone a fresh prototype instead of constructing a new hasher every node.
+    proto = sha3.keccak_256()
+
+    def merkle_hash(left: bytes, right: bytes) -> bytes:
+        h = proto.copy()
+        h.update(left)
+        h.update(right)
+        return h.digest()
+
+    return keccak_256, merkle_hash
 
 
-def merkle_hash(left: bytes, right: bytes) -> bytes:
-    return keccak_256(left + right)
+def _load_eth_hash():
+    from eth_hash.auto import keccak as keccak_256
 
+    def merkle_hash(left: bytes, right: bytes) -> bytes:
+        return keccak_256(left + right)
+
+    return keccak_256, merkle_hash
+
+
+# In order of preference: pycryptodome(x) and pysha3 hash in C,
+# eth-hash wraps one of those again and is only used if it is the only one installed.
+_KECCAK_BACKENDS = (
+    ('pycryptodomex', lambda: _load_pycryptodome('Cryptodome')),
+    ('pycryptodome', lambda: _load_pycryptodome('Crypto')),
+    ('pysha3', _load_pysha3),
+    ('eth-hash', _load_eth_hash),
+)
+
+
+def _select_keccak_backend() -> _Tuple[str, _Callable[[bytes], bytes], _Callable[[bytes, bytes], bytes]]:
+    """Load the first installed keccak backend that works"""
+    for name, load in _KECCAK_BACKENDS:
+        try:
+            keccak_256, merkle_hash = load()
+            # eth-hash only picks its own backend on the first call: it raises an ImportError if none is installed,
+            # or a ValueError if ETH_HASH_BACKEND names an unknown one
+            merkle_hash(b'\x00' * 32, b'\x00' * 32)
+        except (ImportError, ValueError):
+            continue
+        return name, keccak_256, merkle_hash
+    raise ImportError("no keccak256 implementation found, install pycryptodome or pysha3")
+
+
+KECCAK_BACKEND, keccak_256, merkle_hash = _select_keccak_backend()
+
+
+# --- remerkleable settings override ---
+# This has to run when obf is imported, before any other module imports remerkleable.tree (see the imports above).
 
 # The EVM is big-endian, it will be easier to implement a verifier in the EVM if we use big-endian integers,
 # even though SSZ spec is little-endian.
@@ -21,7 +81,5 @@ remerkleable_settings.ENDIANNESS = 'big'
 # Keccak-256 is cheaper in the EVM than calling a sha-256 precompile.
 remerkleable_settings.merkle_hash = merkle_hash
 
-# re-initialize the zero-hashes we use to pad list trees, to use the new hash func
+# re-initialize the zero-hashes we use to pad list trees, to use the new hash func.
 remerkleable_settings.init_zero_hashes()
-
-
@@ -1,20 +1,72 @@
 import click
-from typing import TextIO
+from binascii import a2b_hex
+from heapq import heapify, heappush, heappop
+from typing import TextIO, Dict, Tuple, Iterable
 from .node_shim import ShimNode
-from .brainfuck import Step, next_step, parse_tx, Address, Contract, ExitCodes, Code
+from .brainfuck import Step, next_step, parse_tx, fast_transition, Address, Contract, ExitCodes, Code
 from remerkleable.tree import PairNode, RootNode, Node
-import json
+from remerkleable.settings import zero_hashes
 import sys
 
+try:
+    import orjson
+
+    def json_loads(v: str):
+        return orjson.loads(v)
+
+    def json_dumps(v) -> str:
+        return orjson.dumps(v, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    import json
+
+    def json_loads(v: str):
+        return json.loads(v)
+
+    def json_dumps(v) -> str:
+        return json.dumps(v, indent='  ')
+
 
 def encode_hex(v: bytes) -> str:
     return '0x' + v.hex()
 
 
 def decode_hex(v: str) -> bytes:
-    if v.startswith('0x'):
-        v = v[2:]
-    return bytes.fromhex(v)
+    # a2b_hex is faster than bytes.fromhex (encoding with bytes.hex is already the fastest)
+    return a2b_hex(v[2:] if v.startswith('0x') else v)
+
+
+def _write_json_list(output: TextIO, items: Iterable[str], indent: str) -> None:
+    # Same layout as json.dumps(..., indent='  '), items are already JSON-encoded.
+    output.write('[')
+    empty = True
+    for item in items:
+        output.write((indent + '  ' if empty else ',' + indent + '  ') + item)
+        empty = False
+    output.write(']' if empty else indent + ']')
+
+
+def write_proof(output: TextIO, binary_nodes: Dict[bytes, Tuple[bytes, bytes]],
+                step_roots: Iterable[bytes], access_trace: Iterable[Iterable[int]]) -> None:
+    """Stream the fraud proof JSON to the output, formatted like json.dumps(..., indent='  ') would,
+    without building the full document in memory first"""
+    output.write('{\n  "nodes": {')
+    sep = '\n'
+    for k, (left, right) in binary_nodes.items():
+        output.write(f'{sep}    "{encode_hex(k)}": ')
+        _write_json_list(output, (f'"{encode_hex(left)}"', f'"{encode_hex(right)}"'), '\n    ')
+        sep = ',\n'
+    output.write('}' if sep == '\n' else '\n  }')
+    output.write(',\n  "step_roots": ')
+    _write_json_list(output, (f'"{encode_hex(root)}"' for root in step_roots), '\n  ')
+    # not that this array is 1 shorter, the last step (post output) has no access data
+    output.write(',\n  "access": [')
+    sep = '\n    '
+    for acc_li in access_trace:
+        output.write(sep)
+        _write_json_list(output, (f'"0x{gi:064x}"' for gi in acc_li), '\n    ')
+        sep = ',\n    '
+    output.write(']' if sep == '\n    ' else '\n  ]')
+    output.write('\n}')
 
 
 @click.group()
@@ -44,7 +96,7 @@ def init_state(state: TextIO):
 
     STATE path to world state, will be JSON
     """
-    state.write(json.dumps({
+    state.write(json_dumps({
         "contracts": {
             "0": {
                 "code": ",,,,,,,,,,,,,,,,,,,,,[>+++++++<-]",  # skips the 20 byte address, and then multiplies the first input byte with 7, and stores result in second cell
@@ -52,7 +104,7 @@ def init_state(state: TextIO):
                 "cells": [0]
             }
         },  # 256 contract slots, starting with none
-    }, indent='  '))
+    }))
 
 
 @cli.command()
@@ -61,7 +113,9 @@ def init_state(state: TextIO):
 @click.argument('sender', type=click.STRING)
 @click.argument('contract', type=click.INT)
 @click.argument('tx', type=click.STRING)
-def transition(input: TextIO, output: TextIO, sender: str, contract: int, tx: str):
+@click.option('--only-changed', is_flag=True,
+              help="Only write the updated contract to OUTPUT, not the full world state.")
+def transition(input: TextIO, output: TextIO, sender: str, contract: int, tx: str, only_changed: bool):
     """Transition full transaction TX, read INPUT state and write OUTPUT state
 
     INPUT file/input to current brainfuck world state, encoded in JSON
@@ -77,32 +131,28 @@ def transition(input: TextIO, output: TextIO, sender: str, contract: int, tx: st
     click.echo("decoding transaction: "+tx)
     tx_bytes = decode_hex(tx)
 
-    state_parsed = json.loads(input.read())
+    state_parsed = json_loads(input.read())
 
     contract_inst = Contract.from_obj(contract_parse_code(state_parsed['contracts'][str(contract)]))
 
-    click.echo("loading first step...")
-    step = parse_tx(contract_inst, Address(decode_hex(sender)), tx_bytes)
     click.echo("selected brainfuck contract %d" % contract)
 
-    click.echo("updating state by just generating and applying all fraud proof steps...")
-    n = 0
-    while True:
-        click.echo("\rProcessing step %d" % n, nl=False)
-        n += 1
-        if n >= SANITY_LIMIT:
-            raise Exception("Oh no! So many steps! What happened?")
-
-        step = next_step(step)
-        if step.result_code != 0xff:  # have we finished yet?
-            break
-    print()  # new line after \r loop
+    click.echo("updating state by running the transaction, without fraud proof steps...")
+    # same limit as the step-by-step proof generator: the last allowed step is SANITY_LIMIT-1
+    step = fast_transition(contract_inst, Address(decode_hex(sender)), tx_bytes, max_steps=SANITY_LIMIT - 1)
+    if step.result_code == 0xff:  # did it not finish?
+        raise Exception("Oh no! So many steps! What happened?")
 
     if step.result_code == 0:
         click.echo("success transaction")
         # success, write back new contract state
-        state_parsed['contracts'][str(contract)] = contract_pretty_code(step.contract.to_obj())
-        output.write(json.dumps(state_parsed, indent='  '))
+        changed = contract_pretty_code(step.contract.to_obj())
+        if only_changed:
+            # a partial world state, to merge into the full state: the size does not depend on the other contracts
+            output.write(json_dumps({"contracts": {str(contract): changed}}))
+        else:
+            state_parsed['contracts'][str(contract)] = changed
+            output.write(json_dumps(state_parsed))
     else:
         click.echo(f"failed transaction, no state changes, exit code: {str(ExitCodes(step.result_code))}")
 
@@ -128,11 +178,9 @@ def gen(state: TextIO, output: TextIO, sender: str, contract: int, tx: str):
     """
 
     click.echo("decoding transaction: "+tx)
-    if tx.startswith("0x"):
-        tx = tx[2:]
-    tx_bytes = bytes.fromhex(tx)
+    tx_bytes = decode_hex(tx)
 
-    state_parsed = json.loads(state.read())
+    state_parsed = json_loads(state.read())
 
     contract_inst = Contract.from_obj(contract_parse_code(state_parsed['contracts'][str(contract)]))
 
@@ -141,60 +189,67 @@ def gen(state: TextIO, output: TextIO, sender: str, contract: int, tx: str):
 
     click.echo("selected brainfuck contract %d" % contract)
 
-    steps = [Step(backing=ShimNode.shim(init_step.get_backing()))]
+    # Only the current step is kept around: each step is stored into the proof data as soon as it is done,
+    # and it shares most of its tree with the next step anyway.
+    last = Step(backing=ShimNode.shim(init_step.get_backing()))
+    step_roots = [last.hash_tree_root()]
     access_trace = []
-
-    def reset_shims():
-        for step in steps:
-            backing: ShimNode = step.get_backing()
-            backing.reset_shim()
+    binary_nodes: Dict[bytes, Tuple[bytes, bytes]] = dict()
+    zero_roots = set(zero_hashes)
 
     def capture_access(last: Step):
         shim: ShimNode = last.get_backing()
         access_list = list(shim.get_touched_gindices(g=1))
         access_trace.append(access_list)
 
+    def store_tree(root: PairNode):
+        stack = [root]
+        while stack:
+            b = stack.pop()
+            # The merkle-roots are cached, this is fine
+            key = b.merkle_root()
+            # steps share most of their tree with the previous step, don't walk the same subtree twice.
+            # Zero subtrees are implied by the zero-hashes, step-witness reconstructs these.
+            if key in binary_nodes or key in zero_roots:
+                continue
+            # no get_left/get_right, the shims would register that as access by the next step
+            left, right = b.left, b.right
+            binary_nodes[key] = (left.merkle_root(), right.merkle_root())
+            # push right first, to store the left subtree first
+            if not right.is_leaf():
+                stack.append(right)
+            if not left.is_leaf():
+                stack.append(left)
+
     click.echo("running step by step proof generator...")
     n = 0
     while True:
-        click.echo("\rProcessing step %d" % n, nl=False)
+        if (n & 0x7f) == 0:  # don't let terminal output slow down the steps
+            click.echo("\rProcessing step %d" % n, nl=False)
         n += 1
 
         if n >= SANITY_LIMIT:
             raise Exception("Oh no! So many steps! What happened?")
 
-        reset_shims()
-        last = steps[-1]
+        # Note: steps are generated strictly in order, they cannot be split over workers.
+        # Only the root shim is reset, deeper shim nodes shared with earlier steps keep their touched flags,
+        # and the witness of a step relies on those: a step rebuilt from scratch captures too few nodes to verify.
+        last.get_backing().reset_shim()
         next = next_step(last)
         capture_access(last)
-        steps.append(Step(backing=ShimNode.shim(next.get_backing())))
+        store_tree(last.get_backing())
+        last = Step(backing=ShimNode.shim(next.get_backing()))
+        # Hash each step right after it is created: the subtrees it shares with the previous step have their roots
+        # cached already, so every node of the trace is hashed only once, children before parents.
+        step_roots.append(last.hash_tree_root())
         if next.result_code != 0xff:  # have we finished yet?
             break
-    print()  # new line after \r loop
-
-    binary_nodes = dict()
-
-    def store_tree(b: PairNode):
-        left, right = b.get_left(), b.get_right()
-        # The merkle-roots are cached, this is fine
-        binary_nodes[encode_hex(b.merkle_root())] = [encode_hex(left.merkle_root()), encode_hex(right.merkle_root())]
-        if not left.is_leaf():
-            store_tree(left)
-        if not right.is_leaf():
-            store_tree(right)
-
-    # store all data relevant to all steps
-    for step in steps:
-        store_tree(step.get_backing())
-
-    output.write(json.dumps({
-        'nodes': binary_nodes,
-        'step_roots': [encode_hex(step.hash_tree_root()) for step in steps],
-        'access': [
-            # not that this array is 1 shorter, the last step (post output) has no access data
-            [encode_hex(gi.to_bytes(length=32, byteorder='big')) for gi in acc_li] for acc_li in access_trace
-        ],
-    }, indent='  '))
+    click.echo("\rProcessed %d steps" % n)  # new line after \r loop
+
+    # the post-state of the last step
+    store_tree(last.get_backing())
+
+    write_proof(output, binary_nodes, step_roots, access_trace)
 
     click.echo("done!")
 
@@ -212,39 +267,34 @@ def step_witness(input: TextIO, output: TextIO, step: int):
 
     STEP index of step to generate witness data for.
     """
-    obj = json.loads(input.read())
+    obj = json_loads(input.read())
 
     nodes = obj['nodes']
+    # the proof leaves out the zero-subtrees (padding), add them back
+    for i in range(len(zero_hashes) - 1):
+        nodes.setdefault(encode_hex(zero_hashes[i + 1]), [encode_hex(zero_hashes[i])] * 2)
 
     def retrieve_node_by_gindex(i: int, root: str) -> str:
-        if i == 1:
-            return root
-
-        if root not in nodes:
+        # walk down the bits of the gindex, from the bit after the leading 1 down to the last bit
+        try:
+            for bit in range(i.bit_length() - 2, -1, -1):
+                root = nodes[root][(i >> bit) & 1]
+        except KeyError:
             raise Exception("this should be 1")
-
-        pivot = 1 << (i.bit_length() - 2)
-        go_right = i & pivot != 0
-        # mask out the top bit, and set the new top bit
-        child = (i | pivot) - (pivot << 1)
-        left, right = nodes[root]
-        if go_right:
-            return retrieve_node_by_gindex(child, right)
-        else:
-            return retrieve_node_by_gindex(child, left)
+        return root
 
     pre_root = obj['step_roots'][step]
     post_root = obj['step_roots'][step+1]
 
-    contents = {g: retrieve_node_by_gindex(int.from_bytes(decode_hex(g), byteorder='big'), pre_root)
+    contents = {g: retrieve_node_by_gindex(int(g, 16), pre_root)
                 for g in obj['access'][step]}
 
-    output.write(json.dumps({
+    output.write(json_dumps({
         'node_by_gindex': contents,
         'pre_root': pre_root,
         'post_root': post_root,
         'step': step,
-    }, indent='  '))
+    }))
 
 
 @cli.command()
@@ -258,29 +308,38 @@ def verify(input: TextIO, claimed_post_root: str):
     CLAIMED_POST_ROOT   hex encoded, 0x prefixed, root of contract state
        that is expected after progressing one step further
     """
-    obj = json.loads(input.read())
+    obj = json_loads(input.read())
 
     click.echo('parsing fraud proof')
 
     # parse all gindices and node contents
     node_by_gindex = {
-        int.from_bytes(decode_hex(g), byteorder='big'): decode_hex(node) for g, node in obj['node_by_gindex'].items()
+        int(g, 16): decode_hex(node) for g, node in obj['node_by_gindex'].items()
     }
 
     # Take all those witness nodes by their position, and construct a tree that we can use as backing.
-    # Any other node
-    def construct_backing(g: int) -> Node:
-        if g > 2**60:
-            raise Exception("didn't expect backing branches this deep! witness data must be missing")
-        if g not in node_by_gindex:
-            left = construct_backing(g*2)
-            right = construct_backing(g*2+1)
-            return PairNode(left, right)
-        else:
-            return RootNode(node_by_gindex[g])
-
-    # start at the root, find all sub-node
-    partial_backing = construct_backing(1)
+    # Siblings are paired up bottom-up, deepest (i.e. highest) gindex first, until only the root is left.
+    def construct_backing() -> Node:
+        built: Dict[int, Node] = {g: RootNode(node) for g, node in node_by_gindex.items()}
+        todo = [-g for g in built]  # max-heap
+        heapify(todo)
+        while todo:
+            g = -heappop(todo)
+            if g == 1:
+                return built[1]
+            if g not in built:  # already paired up with its sibling
+                continue
+            if g ^ 1 not in built:
+                raise Exception(f"malformed witness, missing sibling of gindex {g}")
+            left, right = built.pop(g & ~1), built.pop(g | 1)
+            parent = g >> 1
+            # a witness node takes precedence over anything below it
+            if parent not in built:
+                built[parent] = PairNode(left, right)
+                heappush(todo, -parent)
+        raise Exception("malformed witness, missing root")
+
+    partial_backing = construct_backing()
 
     click.echo('verifying fraud proof')
 
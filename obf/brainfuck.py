@@ -1,9 +1,16 @@
+from array import array
+from importlib.util import find_spec
 from enum import IntEnum
-from typing import TypeVar, Type, Callable
+from typing import TypeVar, Type, Callable, Dict, NamedTuple, List as PyList
 from remerkleable.complex import Container, List
-from remerkleable.basic import uint64, uint32, uint8
+from remerkleable.core import ObjParseException, View
+from remerkleable.basic import uint256, uint64, uint32, uint8
 from remerkleable.bitfields import Bitlist
 from remerkleable.byte_arrays import ByteVector
+from remerkleable.tree import NavigationError, PairNode, RootNode, subtree_fill_to_contents, to_gindex
+
+# numpy is optional, it speeds up the code conversions. It is only imported when used, numpy takes ~0.1s to import.
+HAS_NUMPY = find_spec('numpy') is not None
 
 
 class Address(ByteVector[20]):
@@ -42,6 +49,10 @@ MAX_STACK_DEPTH = 1024
 MAX_CONTRACTS = 256
 
 brainfuck_chars = ['>', '<', '+', '-', '.', ',', '[', ']']
+# op -> char byte, and char byte -> op (0xff for non-brainfuck chars), to convert code strings with bytes.translate
+_CHAR_BY_OP = ''.join(brainfuck_chars).encode().ljust(256, b'\x00')
+_OP_BY_CHAR = bytes(brainfuck_chars.index(chr(c)) if chr(c) in brainfuck_chars else 0xff for c in range(256))
+
 
 class ExitCodes(IntEnum):
     OK = 0
@@ -69,37 +80,107 @@ class OpCode(IntEnum):
         return self.character()
 
 
-V = TypeVar('V')
+# Plain int copies of the op codes, for the interpreters and compile_code: comparing plain ints skips the enum
+# attribute lookups. OpCode itself is for presenting ops, e.g. as characters.
+_MOVE_RIGHT, _MOVE_LEFT, _INCR_CELL, _DECR_CELL, _GET_CELL, _PUT_CELL, _JUMP_COND, _JUMP_BACK = range(8)
+
+V = TypeVar('V', bound=View)
+L = TypeVar('L', bound=List)
+
+# Bitlist bytes are little-endian bit order, but the first bit of an op is its most significant bit.
+_REV3 = (0b000, 0b100, 0b010, 0b110, 0b001, 0b101, 0b011, 0b111)
 
 
 # 3 bits per brainfuck opcode, utilize all that data!
 class Code(Bitlist[MAX_CODE_SIZE]):
     @classmethod
     def from_pretty_str(cls: Type[V], v: str) -> V:
-        ops = [brainfuck_chars.index(c) for c in v]
-        bits = []
-        for op in ops:
-            for j in range(2, -1, -1):
-                bits.append(op & (1 << j) != 0)
-        return cls(bits)
+        # look up the op of every char at once, then spread each op over 3 bits (most significant first),
+        # and pack them little-endian, with the delimiting bit of the bitlist after them
+        ops = v.encode().translate(_OP_BY_CHAR)
+        if b'\xff' in ops:
+            raise ValueError(f"code {v!r} contains non-brainfuck characters")
+        if HAS_NUMPY:
+            import numpy as np
+            bits = ((np.frombuffer(ops, dtype=np.uint8)[:, np.newaxis] >> np.array([2, 1, 0], dtype=np.uint8)) & 1)
+            return cls.decode_bytes(np.packbits(np.append(bits.ravel(), np.uint8(1)), bitorder='little').tobytes())
+        bit_count = len(ops) * 3
+        buf = bytearray()
+        # every 8 ops fill exactly 3 bytes, build them as a single 24 bit word
+        for j in range(0, len(ops), 8):
+            word = 0
+            for k, op in enumerate(ops[j:j+8]):
+                word |= _REV3[op] << (k * 3)
+            buf += word.to_bytes(3, 'little')
+        del buf[(bit_count >> 3) + 1:]
+        buf.extend(bytes((bit_count >> 3) + 1 - len(buf)))
+        buf[bit_count >> 3] |= 1 << (bit_count & 7)
+        return cls.decode_bytes(bytes(buf))
 
     def to_pretty_str(self) -> str:
-        bits = list(self)  # faster
-        ops = [((int(bits[j]) << 2) | (int(bits[j+1]) << 1) | int(bits[j+2])) for j in range(0, len(bits), 3)]
-        return ''.join(brainfuck_chars[op] for op in ops)
+        return bytes(self.op_list()).translate(_CHAR_BY_OP).decode()
+
+    def op_list(self) -> PyList[int]:
+        buf = self.encode_bytes()
+        count = self.op_count()
+        if HAS_NUMPY:
+            import numpy as np
+            bits = np.unpackbits(np.frombuffer(buf, dtype=np.uint8), bitorder='little')[:count * 3].reshape(-1, 3)
+            return ((bits[:, 0] << 2) | (bits[:, 1] << 1) | bits[:, 2]).tolist()
+        ops: PyList[int] = []
+        # every 3 bytes hold exactly 8 ops, extract them from a single 24 bit word
+        for j in range(0, len(buf), 3):
+            word = int.from_bytes(buf[j:j+3], 'little')
+            ops.extend(_REV3[(word >> k) & 0b111] for k in range(0, 24, 3))
+        del ops[count:]
+        return ops
 
     def op_count(self) -> uint32:
         return len(self) // 3
 
-    def get_op(self, i: uint32) -> OpCode:
-        i *= 3
-        a, b, c = self[i], self[i + 1], self[i + 2]
-        op = (int(a) << 2) | (int(b) << 1) | int(c)
-        return OpCode(op)
+    def get_op(self, i: uint32) -> int:
+        # Decode the length, and get each chunk holding the 3 bits of the op, only once,
+        # instead of per bit with self[i]. This navigates to the very same tree nodes.
+        # Returns the plain int value of the OpCode, next_step dispatches on it without constructing the enum.
+        i = int(i) * 3
+        ll = self.length()
+        if i + 3 > ll:
+            raise NavigationError(f"cannot get op bits {i}..{i + 2} in bits of length {ll}")
+        depth = self.__class__.tree_depth()
+        backing = self.get_backing()
+        chunk_i = -1
+        chunk = b''
+        op = 0
+        for j in range(i, i + 3):
+            if (j >> 8) != chunk_i:
+                chunk_i = j >> 8
+                chunk = backing.getter(to_gindex(chunk_i, depth)).root
+            op = (op << 1) | ((chunk[(j & 0xff) >> 3] >> (j & 0x7)) & 1)
+        return op
+
+
+def uint8_list_from_bytes(cls: Type[L], data: bytes) -> L:
+    """Create a List[uint8, N] view from raw bytes, by packing the 32-byte chunks into a tree directly,
+    instead of coercing every byte into a uint8 view first"""
+    chunks = [RootNode(data[i:i+32].ljust(32, b'\x00')) for i in range(0, len(data), 32)]
+    contents = subtree_fill_to_contents(chunks, cls.contents_depth())
+    return cls(backing=PairNode(contents, uint256(len(data)).get_backing()))
 
 
 class Cells(List[uint8, MAX_CELL_COUNT]):
-    pass
+    @classmethod
+    def from_obj(cls: Type[L], obj) -> L:
+        # states hold the cells as a list of ints, pack them as bytes instead of one uint8 view per cell
+        if not isinstance(obj, (list, tuple)):
+            raise ObjParseException(f"obj '{obj}' is not a list or tuple")
+        if len(obj) > cls.limit():
+            raise ObjParseException(f"obj has {len(obj)} cells, more than the limit of {cls.limit()}")
+        try:
+            data = bytes(obj)
+        except (TypeError, ValueError):
+            # not all plain ints in range, e.g. ints as strings: coerce every cell like List.from_obj does
+            data = bytes(uint8.from_obj(el) for el in obj)
+        return uint8_list_from_bytes(cls, data)
 
 
 class PayloadData(List[uint8, MAX_PAYLOAD_DATA]):
@@ -141,12 +222,117 @@ def parse_tx(contract: Contract, sender: Address, payload: bytes) -> Step:
         stack=[],
         contract=contract,
         input_read=0,
-        input_data=PayloadData(list(sender)+list(payload)),
+        input_data=uint8_list_from_bytes(PayloadData, bytes(sender) + payload),
         result_code=0xff,  # unused value to start with, either 0 or 1 at the end
     )
 
 
+def _op_move_right(last: Step, next: Step, pc: uint32) -> Step:
+    ptr = last.contract.ptr
+    if ptr < MAX_CELL_COUNT - 1:
+        if ptr + 1 >= len(last.contract.cells):  # dynamically grow the cells data
+            next.contract.cells.append(uint8(0))
+        next.contract.ptr = ptr + 1
+        next.pc += 1
+        return next
+    else:
+        next.result_code = ExitCodes.PtrTooHigh
+        return next
+
+
+def _op_move_left(last: Step, next: Step, pc: uint32) -> Step:
+    ptr = last.contract.ptr
+    if ptr != 0:
+        next.contract.ptr = ptr - 1
+        next.pc += 1
+        return next
+    else:
+        next.result_code = ExitCodes.NegativePtr
+        return next
+
+
+def _op_incr_cell(last: Step, next: Step, pc: uint32) -> Step:
+    ptr = last.contract.ptr
+    cell_value = last.contract.cells[ptr]
+    next.contract.cells[ptr] = (int(cell_value) + 1) & 0xff  # we want over/underflow here
+    next.pc += 1
+    return next
+
+
+def _op_decr_cell(last: Step, next: Step, pc: uint32) -> Step:
+    ptr = last.contract.ptr
+    cell_value = last.contract.cells[ptr]
+    next.contract.cells[ptr] = (int(cell_value) - 1) & 0xff  # we want over/underflow here
+    next.pc += 1
+    return next
+
+
+def _op_get_cell(last: Step, next: Step, pc: uint32) -> Step:
+    cell_value = last.contract.cells[last.contract.ptr]
+    if cell_value == 0 or cell_value == 1:
+        next.result_code = cell_value
+        return next
+    else:
+        # ignore the value, continue
+        next.pc += 1
+        return next
+
+
+def _op_put_cell(last: Step, next: Step, pc: uint32) -> Step:
+    if last.input_read < len(last.input_data):
+        new_cell_value = last.input_data[last.input_read]
+    else:
+        new_cell_value = 0
+    next.contract.cells[last.contract.ptr] = new_cell_value
+    next.input_read += 1
+    next.pc += 1
+    return next
+
+
+def _op_jump_cond(last: Step, next: Step, pc: uint32) -> Step:
+    cell_value = last.contract.cells[last.contract.ptr]
+    if cell_value == 0:
+        # we want to skip to matching ], we do this by tracking indentation
+        next.pc += 1
+        next.indent += 1
+        return next
+    else:
+        if len(last.stack) == MAX_STACK_DEPTH:
+            next.result_code = ExitCodes.StackOverflow
+            return next
+        next.stack.append(pc)
+        next.pc += 1
+        return next
+
+
+def _op_jump_back(last: Step, next: Step, pc: uint32) -> Step:
+    depth = len(last.stack)
+    if depth == 0:
+        next.result_code = ExitCodes.StackUnderflow
+        return next
+    back_pc = last.stack[depth - 1]
+    next.stack.pop()
+    next.pc = back_pc
+    return next
+
+
+# next_step handlers, indexed by op code: a single lookup instead of a chain of comparisons
+_OP_HANDLERS = (
+    _op_move_right,
+    _op_move_left,
+    _op_incr_cell,
+    _op_decr_cell,
+    _op_get_cell,
+    _op_put_cell,
+    _op_jump_cond,
+    _op_jump_back,
+)
+
+
 def next_step(last: Step) -> Step:
+    # Copying a view is cheap: it is a new view on the same immutable backing tree,
+    # modifications of next only rebind the path to the changed node. The last step stays intact,
+    # the proof generator needs both the pre- and post-state of every step.
     next = last.copy()
     pc = last.pc
 
@@ -172,15 +358,17 @@ def next_step(last: Step) -> Step:
     # print("cells", list(last.contract.cells))
     # print("indent", last.indent)
 
+    # Skipping a block is intentionally one op per step, at 1 gas each: the skip is part of the fraud proof trace,
+    # and every step has to be verifiable on its own. Only fast_transition jumps ahead, see compile_code.
     if last.indent > 0:
-        if op == OpCode.JUMP_COND:
+        if op == _JUMP_COND:
             if last.indent > MAX_STACK_DEPTH:
                 next.result_code = ExitCodes.StackOverflow
                 return next
             next.indent += 1
             next.pc += 1
             return next
-        elif op == OpCode.JUMP_BACK:
+        elif op == _JUMP_BACK:
             next.indent -= 1
             next.pc += 1
             return next
@@ -188,73 +376,239 @@ def next_step(last: Step) -> Step:
             next.pc += 1
             return next
 
-    if op == OpCode.MOVE_RIGHT:
-        if last.contract.ptr < MAX_CELL_COUNT - 1:
-            if last.contract.ptr + 1 >= len(last.contract.cells):  # dynamically grow the cells data
-                next.contract.cells.append(uint8(0))
-            next.contract.ptr += 1
-            next.pc += 1
-            return next
-        else:
-            next.result_code = ExitCodes.PtrTooHigh
-            return next
-    elif op == OpCode.MOVE_LEFT:
-        if last.contract.ptr != 0:
-            next.contract.ptr -= 1
-            next.pc += 1
-            return next
-        else:
-            next.result_code = ExitCodes.NegativePtr
-            return next
-    elif op == OpCode.INCR_CELL:
-        cell_value = last.contract.cells[last.contract.ptr]
-        next.contract.cells[last.contract.ptr] = (int(cell_value) + 1) % 256  # we want over/underflow here
-        next.pc += 1
-        return next
-    elif op == OpCode.DECR_CELL:
-        cell_value = last.contract.cells[last.contract.ptr]
-        next.contract.cells[last.contract.ptr] = (int(cell_value) + 256 - 1) % 256  # we want over/underflow here
-        next.pc += 1
-        return next
-    elif op == OpCode.GET_CELL:
-        cell_value = last.contract.cells[last.contract.ptr]
-        if cell_value == 0 or cell_value == 1:
-            next.result_code = cell_value
-            return next
-        else:
+    return _OP_HANDLERS[op](last, next, pc)
+
+
+class CompiledCode(NamedTuple):
+    # op per op index
+    ops: bytes
+    # For every '[' op index, the index of its matching ']', or -1 if the block cannot be skipped in one go:
+    # when it is unmatched, or when skipping it op by op would hit the MAX_STACK_DEPTH indent limit.
+    jumps: array
+    # For every '>', '<', '+' and '-' op index, the number of repeats of the op, starting from there.
+    runs: array
+    # For every '[' op index that starts a clear loop '[-]' or a move loop like '[->>+<<]' or '[-<+>]':
+    # the cell offset that the loop adds the value to (0 for a clear loop), or 0 for any other op.
+    loop_offsets: array
+    # For the same loops, what the loop adds to the cell at the offset per round (0 for a clear loop),
+    # or -1 if the op does not start such a loop.
+    loop_factors: array
+
+
+# code bytes -> compiled code, contracts are called many times with the same code
+_compiled_code: Dict[bytes, CompiledCode] = {}
+
+
+def compile_code(code: Code) -> CompiledCode:
+    """Decode the ops, and precompute the tables that fast_transition uses to take multiple steps at once"""
+    key = code.encode_bytes()
+    compiled = _compiled_code.get(key)
+    if compiled is not None:
+        return compiled
+    ops = code.op_list()
+
+    jumps = array('i', [-1]) * len(ops)
+    # (pc of unmatched '[', deepest '[' within it), the depth of a '[' is the count of unmatched '[' before it
+    stack: PyList[PyList[int]] = []
+    for pc, op in enumerate(ops):
+        if op == _JUMP_COND:
+            stack.append([pc, len(stack)])
+        elif op == _JUMP_BACK and len(stack) > 0:
+            start, deepest = stack.pop()
+            if deepest - len(stack) <= MAX_STACK_DEPTH:
+                jumps[start] = pc
+            if len(stack) > 0:
+                stack[-1][1] = max(stack[-1][1], deepest)
+
+    runs = array('i', [1]) * len(ops)
+    for pc in range(len(ops) - 2, -1, -1):
+        if ops[pc] <= _DECR_CELL and ops[pc] == ops[pc + 1]:
+            runs[pc] = runs[pc + 1] + 1
+
+    loop_offsets = array('i', [0]) * len(ops)
+    loop_factors = array('i', [-1]) * len(ops)
+    for pc, op in enumerate(ops):
+        end = jumps[pc]
+        if op != _JUMP_COND or end < 0 or ops[pc + 1] != _DECR_CELL or runs[pc + 1] != 1:
+            continue
+        if end == pc + 2:
+            loop_factors[pc] = 0
+            continue
+        # '-', then k moves one way, one or more '+', and k moves back, to end up where the loop started
+        move = pc + 2
+        if ops[move] > _MOVE_LEFT:
+            continue
+        incr = move + runs[move]
+        if ops[incr] != _INCR_CELL:
+            continue
+        back = incr + runs[incr]
+        if ops[back] != ops[move] ^ 1 or runs[back] != runs[move] or back + runs[back] != end:
+            continue
+        loop_offsets[pc] = runs[move] if ops[move] == _MOVE_RIGHT else -runs[move]
+        loop_factors[pc] = runs[incr]
+
+    compiled = CompiledCode(ops=bytes(ops), jumps=jumps, runs=runs,
+                            loop_offsets=loop_offsets, loop_factors=loop_factors)
+    _compiled_code[key] = compiled
+    return compiled
+
+
+# Plain int copies of the exit codes, for the interpreter kernel below.
+_OK, _STACK_OVERFLOW, _STACK_UNDERFLOW, _NEGATIVE_PTR, _PTR_TOO_HIGH, _OUT_OF_GAS = range(6)
+
+
+def _run_ops(ops, jumps, runs, loop_offsets, loop_factors, cells, cells_len, ptr, input_data, gas, max_steps, stack):
+    # The interpreter loop of fast_transition, on plain values only.
+    # cells and stack are preallocated to their maximum size, and modified in place.
+    size = len(ops)
+    input_len = len(input_data)
+    pc = 0
+    stack_len = 0
+    indent = 0
+    input_read = 0
+    result_code = 0xff
+
+    # Every step spends exactly 1 gas, so the gas counts the steps too, there is no separate step counter:
+    # the steps run out when the gas is down to stop (below 0 if the gas runs out first),
+    # and ops can be applied in bulk as long as that leaves at least floor gas.
+    stop = gas - max_steps
+    floor = max(stop, 0)
+    while gas > stop:
+        if pc >= size:
+            result_code = _OK
+            break
+
+        # count 1 gas for this operation
+        if gas == 0:
+            result_code = _OUT_OF_GAS
+            break
+        gas -= 1
+
+        op = ops[pc]
+
+        if indent > 0:
+            if op == _JUMP_COND:
+                if indent > MAX_STACK_DEPTH:
+                    result_code = _STACK_OVERFLOW
+                    break
+                indent += 1
+            elif op == _JUMP_BACK:
+                indent -= 1
+            pc += 1
+            continue
+
+        if ptr >= cells_len and _INCR_CELL <= op <= _JUMP_COND:
+            # only reachable from a contract state with the pointer beyond its cells, next_step fails the same way
+            raise IndexError(f"cell {ptr} is out of bounds of {cells_len} cells")
+
+        if op <= _DECR_CELL:
+            # A run of the same op is applied at once, as far as the gas, steps and pointer bounds allow.
+            # The step-by-step execution spends 1 gas and 1 step on each of them.
+            n = min(runs[pc], gas - floor + 1)
+            if op == _MOVE_RIGHT:
+                n = min(n, MAX_CELL_COUNT - 1 - ptr)
+                if n == 0:
+                    result_code = _PTR_TOO_HIGH
+                    break
+                # dynamically grow the cells data, by a cell per step if the pointer is beyond the cells already
+                if ptr >= cells_len:
+                    cells_len += n
+                elif ptr + n >= cells_len:
+                    cells_len = ptr + n + 1
+                ptr += n
+            elif op == _MOVE_LEFT:
+                n = min(n, ptr)
+                if n == 0:
+                    result_code = _NEGATIVE_PTR
+                    break
+                ptr -= n
+            elif op == _INCR_CELL:
+                cells[ptr] = (cells[ptr] + n) & 0xff  # we want over/underflow here
+            else:
+                cells[ptr] = (cells[ptr] - n) & 0xff  # we want over/underflow here
+            gas -= n - 1
+            pc += n
+        elif op == _GET_CELL:
+            cell_value = int(cells[ptr])
+            if cell_value == 0 or cell_value == 1:
+                result_code = cell_value
+                break
             # ignore the value, continue
-            next.pc += 1
-            return next
-    elif op == OpCode.PUT_CELL:
-        if last.input_read < len(last.input_data):
-            new_cell_value = last.input_data[last.input_read]
-        else:
-            new_cell_value = 0
-        next.contract.cells[last.contract.ptr] = new_cell_value
-        next.input_read += 1
-        next.pc += 1
-        return next
-    elif op == OpCode.JUMP_COND:
-        cell_value = last.contract.cells[last.contract.ptr]
-        if cell_value == 0:
-            # we want to skip to matching ], we do this by tracking indentation
-            next.pc += 1
-            next.indent += 1
-            return next
-        else:
-            if len(last.stack) == MAX_STACK_DEPTH:
-                next.result_code = ExitCodes.StackOverflow
-                return next
-            next.stack.append(pc)
-            next.pc += 1
-            return next
-    elif op == OpCode.JUMP_BACK:
-        if len(last.stack) == 0:
-            next.result_code = ExitCodes.StackUnderflow
-            return next
-        back_pc = last.stack[len(last.stack) - 1]
-        next.stack.pop()
-        next.pc = back_pc
-        return next
-    else:
-        raise Exception(f"opcode parsing broken, unrecognized op: {op}")
+            pc += 1
+        elif op == _PUT_CELL:
+            if input_read < input_len:
+                cells[ptr] = input_data[input_read]
+            else:
+                cells[ptr] = 0
+            input_read += 1
+            pc += 1
+        elif op == _JUMP_COND:
+            if cells[ptr] == 0:
+                # Skip to the matching ] at once. The step-by-step execution tracks indentation instead,
+                # and spends 1 gas and 1 step per skipped op, so only jump if that would not run out halfway.
+                skipped = jumps[pc] - pc
+                if jumps[pc] >= 0 and skipped <= gas - floor:
+                    gas -= skipped
+                    pc += skipped + 1
+                else:
+                    pc += 1
+                    indent += 1
+            else:
+                # A clear or move loop runs its body cells[ptr] times, and then skips over the body once.
+                # Every round and the skip cost as many steps and gas as there are ops in the loop.
+                # Only apply it at once if it would not run out, nor move out of bounds halfway.
+                v = int(cells[ptr])
+                extra = (jumps[pc] - pc + 1) * (v + 1) - 1
+                target = ptr + loop_offsets[pc]
+                if (loop_factors[pc] >= 0 and stack_len < MAX_STACK_DEPTH and extra <= gas - floor
+                        and 0 <= target < MAX_CELL_COUNT):
+                    cells[ptr] = 0
+                    cells[target] = (cells[target] + v * loop_factors[pc]) & 0xff
+                    if target >= cells_len:
+                        cells_len = target + 1
+                    gas -= extra
+                    pc = jumps[pc] + 1
+                    continue
+                if stack_len == MAX_STACK_DEPTH:
+                    result_code = _STACK_OVERFLOW
+                    break
+                stack[stack_len] = pc
+                stack_len += 1
+                pc += 1
+        else:  # _JUMP_BACK, ops are 3 bits, there are no other values
+            if stack_len == 0:
+                result_code = _STACK_UNDERFLOW
+                break
+            stack_len -= 1
+            pc = stack[stack_len]
+
+    return result_code, gas, pc, stack_len, indent, cells_len, ptr, input_read
+
+
+def fast_transition(contract: Contract, sender: Address, payload: bytes, max_steps: int) -> Step:
+    """Run a full transaction, with the exact same outcome as repeatedly applying next_step to parse_tx(...),
+    but operating on plain values instead of merkle-tree backed views.
+    Only the final step is converted back into a Step view, there is no per-step data to generate proofs with.
+    If the transaction is not finished after max_steps steps, the returned step has result code 0xff."""
+    gas = GAS_FREE_STIPEND + len(payload) * L1_CALLDATA_TO_L2_GAS_MULTIPLIER
+    compiled = compile_code(contract.code)
+    cells_len = len(contract.cells)
+    input_data = bytes(sender) + payload
+
+    cells = bytearray(MAX_CELL_COUNT)
+    cells[:cells_len] = contract.cells.encode_bytes()
+    stack = [0] * MAX_STACK_DEPTH
+    out = _run_ops(compiled.ops, compiled.jumps, compiled.runs, compiled.loop_offsets, compiled.loop_factors,
+                   cells, cells_len, int(contract.ptr), input_data, gas, max_steps, stack)
+    result_code, gas, pc, stack_len, indent, cells_len, ptr, input_read = out
+
+    return Step(
+        gas=gas,
+        pc=pc,
+        stack=stack[:stack_len],
+        indent=indent,
+        contract=Contract(code=contract.code, cells=uint8_list_from_bytes(Cells, bytes(cells[:cells_len])), ptr=ptr),
+        input_read=input_read,
+        input_data=uint8_list_from_bytes(PayloadData, input_data),
+        result_code=result_code,
+    )
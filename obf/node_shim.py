@@ -1,4 +1,4 @@
-from typing import Generator
+from typing import Generator, List, Optional, Tuple
 from remerkleable.tree import Node, PairNode, Gindex
 
 
@@ -43,20 +43,18 @@ class ShimNode(PairNode):
         return sh
 
     def get_touched_gindices(self, g: int = 1) -> Generator[Gindex, None, None]:
-        if self._touched_left:
-            if isinstance(self.left, ShimNode):
-                yield from self.left.get_touched_gindices(g*2)
-            else:
-                yield g*2
-        else:
-            yield g*2
-        if self._touched_right:
-            if isinstance(self.right, ShimNode):
-                yield from self.right.get_touched_gindices(g*2+1)
-            else:
-                yield g*2+1
-        else:
-            yield g*2+1
+        # Depth-first, left to right, with an explicit stack instead of nested generators.
+        # Entries are a touched shim to descend into, or None for a gindex that is yielded as-is.
+        stack: List[Tuple[Optional[ShimNode], int]] = [(self, g)]
+        while stack:
+            node, g = stack.pop()
+            if node is None:
+                yield g
+                continue
+            right = node.right
+            stack.append((right if node._touched_right and isinstance(right, ShimNode) else None, g*2+1))
+            left = node.left
+            stack.append((left if node._touched_left and isinstance(left, ShimNode) else None, g*2))
 
     def reset_shim(self) -> None:
         self._touched_left = False
@@ -20,6 +20,8 @@ setup(
     extras_require={
         "testing": ["pytest"],
         "linting": ["flake8", "mypy"],
+        # optional: faster JSON (de)serialization of states and proofs, and vectorized code conversion
+        "speedups": ["orjson", "numpy"],
     },
     install_requires=[
         "remerkleable==0.1.24",
@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+from obf._cli import SANITY_LIMIT
+from obf.brainfuck import (
+    Address, Code, Contract, ExitCodes, Step, GAS_FREE_STIPEND, L1_CALLDATA_TO_L2_GAS_MULTIPLIER, MAX_STACK_DEPTH,
+    fast_transition, next_step, parse_tx,
+)
+
+SENDER = Address(b'\xaa' * 20)
+
+PROGRAMS = [
+    "",
+    "+.",
+    "++.",
+    "-[-]+.",
+    ",[.,]",
+    "+[>+]",
+    "+[>[+]<-]",
+    "+[[-]]>,.",
+    ",,,[>+++++++<-]",
+    ",>++++[<++++++>-]<[>>+>+<<<-]>>>[<<<+>>>-]<<[-]>[->+<]++[>++[>+<-]<-]<<[-].",
+    "+" * 50 + "[-<]",
+]
+
+NESTED_PROGRAMS = [
+    "+[[[-]]]>+.",
+    "+++[>++[>+[-]<-]<-]",
+    "[[[]]]<",
+    "[[[[]]]]+.",
+    "+[" * 5 + "-" + "]" * 5,
+] + [
+    # skipping blocks around the MAX_STACK_DEPTH indent limit
+    prefix + "[" * depth + "]" * depth + "]+."
+    for depth in (MAX_STACK_DEPTH - 1, MAX_STACK_DEPTH, MAX_STACK_DEPTH + 1)
+    for prefix in ("", "+[", "+[-")
+]
+
+INVALID_BRACKET_PROGRAMS = ["]", "[", "[[", "]]", "][", "+]", "+[", "+[]", "+[[]", "+[]]]+.", "[[[[]]]]]]]]+."]
+
+_rng = random.Random(1)
+RANDOM_PROGRAMS = [''.join(_rng.choice('><+-.,[]') for _ in range(_rng.randint(1, 40))) for _ in range(40)]
+
+MAX_STEPS = (0, 1, SANITY_LIMIT - 1)
+
+STATES = (([0], 0), ([3, 0, 1], 2))
+
+PAYLOADS = (b'', b'\x05\x00\x03')
+
+
+def gas_for(payload: bytes) -> int:
+    return GAS_FREE_STIPEND + len(payload) * L1_CALLDATA_TO_L2_GAS_MULTIPLIER
+
+
+_reference_roots = {}
+
+
+def reference_transition(contract: Contract, payload: bytes, max_steps: int) -> Step:
+    """Apply next_step until the transaction is done, at most max_steps times"""
+    step = parse_tx(contract, SENDER, payload)
+    for _ in range(max_steps):
+        step = next_step(step)
+        if step.result_code != 0xff:
+            break
+    return step
+
+
+def reference_root(code: str, cells, ptr: int, payload: bytes, max_steps: int) -> bytes:
+    key = (code, tuple(cells), ptr, payload, max_steps)
+    if key not in _reference_roots:
+        contract = Contract(code=Code.from_pretty_str(code), cells=cells, ptr=ptr)
+        _reference_roots[key] = reference_transition(contract, payload, max_steps).hash_tree_root()
+    return _reference_roots[key]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+@pytest.mark.parametrize("cells,ptr", STATES)
+@pytest.mark.parametrize("max_steps", MAX_STEPS)
+@pytest.mark.parametrize("code", PROGRAMS + NESTED_PROGRAMS + INVALID_BRACKET_PROGRAMS + RANDOM_PROGRAMS)
+def test_matches_next_step(code, max_steps, cells, ptr, payload):
+    contract = Contract(code=Code.from_pretty_str(code), cells=cells, ptr=ptr)
+    step = fast_transition(contract, SENDER, payload, max_steps)
+    assert step.hash_tree_root() == reference_root(code, cells, ptr, payload, max_steps)
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+@pytest.mark.parametrize("extra_steps", (-1, 0, 1, 2))
+def test_gas_limit(payload, extra_steps):
+    # an infinite loop only stops when it runs out of gas, one step after spending the last of it
+    gas = gas_for(payload)
+    max_steps = gas + extra_steps
+    step = fast_transition(Contract(code=Code.from_pretty_str("+[]"), cells=[0], ptr=0), SENDER, payload, max_steps)
+    assert step.result_code == (ExitCodes.OutOfGas if extra_steps > 0 else 0xff)
+    assert step.gas == max(gas - max_steps, 0)
+    assert step.hash_tree_root() == reference_root("+[]", [0], 0, payload, max_steps)
+
+
+@pytest.mark.parametrize("code", ["", "+", ".", ",", "[-]", "]", ">", ">>>", ">+", "<", "<+.", "<<<[-]+.", ">><<<<+."])
+@pytest.mark.parametrize("cells,ptr", (([], 0), ([1, 2], 2), ([1], 5), ([1, 0, 3], 4)))
+def test_ptr_out_of_bounds(code, cells, ptr):
+    # Such a contract state is invalid, but next_step only fails on the first access of a cell out of bounds:
+    # moving the pointer, or moving it back within the cells first, works the same in both.
+    contract = Contract(code=Code.from_pretty_str(code), cells=cells, ptr=ptr)
+    try:
+        expected = reference_transition(contract, b'', SANITY_LIMIT - 1)
+    except IndexError:
+        with pytest.raises(IndexError):
+            fast_transition(contract, SENDER, b'', SANITY_LIMIT - 1)
+    else:
+        assert fast_transition(contract, SENDER, b'', SANITY_LIMIT - 1).hash_tree_root() == expected.hash_tree_root()